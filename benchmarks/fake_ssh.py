@@ -0,0 +1,116 @@
+import logging
+import socket
+import threading
+import time
+
+import paramiko
+
+SEND_CHUNK_SIZE = 32 * 1024
+
+
+class _StubServerInterface(paramiko.ServerInterface):
+    def __init__(self, stub: "FakeSSHServer"):
+        self.stub = stub
+
+    def get_allowed_auths(self, username):
+        return "password"
+
+    def check_auth_password(self, username, password):
+        return paramiko.AUTH_SUCCESSFUL
+
+    def check_channel_request(self, kind, chanid):
+        if kind == "session":
+            return paramiko.OPEN_SUCCEEDED
+        return paramiko.OPEN_FAILED_ADMINISTRATIVELY_PROHIBITED
+
+    def check_channel_exec_request(self, channel, command):
+        threading.Thread(target=self.stub._run_exec, args=(channel, command.decode()), daemon=True).start()
+        return True
+
+
+class FakeSSHServer:
+    """In-process SSH server that answers every ``exec`` request with synthetic output.
+
+    ``latency`` is slept before any output is sent and ``output_size`` bytes of line-oriented
+    text are written to stdout. Both can be changed between runs with ``configure``.
+    """
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 0, latency: float = 0.0,
+                 output_size: int = 1024, exit_status: int = 0):
+        self.host = host
+        self.host_key = paramiko.RSAKey.generate(2048)
+        self.exit_status = exit_status
+        self.commands = []
+        self.latency = 0.0
+        self.payload = b""
+        self.configure(latency=latency, output_size=output_size)
+
+        self._sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self._sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self._sock.bind((host, port))
+        self._sock.listen(128)
+        self.port = self._sock.getsockname()[1]
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def configure(self, latency: float = None, output_size: int = None):
+        if latency is not None:
+            self.latency = latency
+        if output_size is not None:
+            self.payload = self._build_payload(output_size)
+
+    @staticmethod
+    def _build_payload(size: int) -> bytes:
+        lines = []
+        total = 0
+        number = 0
+        while total < size:
+            line = f"{number:08d} benchmark output line <tag> & `fence`\n".encode()
+            lines.append(line)
+            total += len(line)
+            number += 1
+        return b"".join(lines)[:size]
+
+    def start(self):
+        self._thread = threading.Thread(target=self._accept_loop, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+        self._sock.close()
+
+    def _accept_loop(self):
+        while not self._stopped.is_set():
+            try:
+                client, _ = self._sock.accept()
+            except OSError:
+                break
+            threading.Thread(target=self._serve_client, args=(client,), daemon=True).start()
+
+    def _serve_client(self, client: socket.socket):
+        transport = paramiko.Transport(client)
+        transport.add_server_key(self.host_key)
+        try:
+            transport.start_server(server=_StubServerInterface(self))
+        except (paramiko.SSHException, EOFError) as e:
+            logging.debug(f"Fake SSH handshake failed: {e}")
+            transport.close()
+
+    def _run_exec(self, channel: paramiko.Channel, command: str):
+        self.commands.append(command)
+        try:
+            if self.latency:
+                time.sleep(self.latency)
+            payload = self.payload
+            for i in range(0, len(payload), SEND_CHUNK_SIZE):
+                channel.sendall(payload[i:i + SEND_CHUNK_SIZE])
+            channel.send_exit_status(self.exit_status)
+            channel.shutdown_write()
+            # Closing first can race the exec request's success reply, so let the client close
+            channel.settimeout(30)
+            while channel.recv(SEND_CHUNK_SIZE):
+                pass
+        except (OSError, EOFError, paramiko.SSHException) as e:
+            logging.debug(f"Fake SSH exec of '{command}' aborted: {e}")
+        finally:
+            channel.close()
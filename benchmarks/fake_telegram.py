@@ -0,0 +1,188 @@
+import html
+import itertools
+import json
+import re
+import time
+from collections import Counter
+
+from aiohttp import web
+
+TELEGRAM_MESSAGE_LIMIT = 4096
+TELEGRAM_CAPTION_LIMIT = 1024
+# Tags the Bot API accepts with parse_mode=HTML
+TELEGRAM_HTML_TAGS = {"b", "strong", "i", "em", "u", "ins", "s", "strike", "del", "span", "tg-spoiler",
+                      "a", "tg-emoji", "code", "pre", "blockquote"}
+_HTML_TOKEN = re.compile(r"<(/?)([a-zA-Z][\w-]*)(?:\s[^<>]*)?>|&(#\d+|#x[0-9a-fA-F]+|lt|gt|amp|quot);|[<&]")
+
+
+class EntityParseError(ValueError):
+    pass
+
+
+def utf16_length(text: str) -> int:
+    # Telegram measures text in UTF-16 code units, so characters outside the BMP count twice
+    return len(text.encode("utf-16-le")) // 2
+
+
+def parse_html_length(text: str) -> int:
+    """Validate text like the Bot API's HTML parser and return its UTF-16 length after entity parsing."""
+    length = 0
+    position = 0
+    open_tags = []
+    for match in _HTML_TOKEN.finditer(text):
+        length += utf16_length(text[position:match.start()])
+        position = match.end()
+        closing, tag, entity = match.groups()
+        if tag:
+            tag = tag.lower()
+            if tag not in TELEGRAM_HTML_TAGS:
+                raise EntityParseError(f'can\'t parse entities: unsupported start tag "{tag}" at byte offset {match.start()}')
+            if not closing:
+                open_tags.append(tag)
+            elif not open_tags or open_tags.pop() != tag:
+                raise EntityParseError(f'can\'t parse entities: unmatched end tag "{tag}" at byte offset {match.start()}')
+        elif entity:
+            length += utf16_length(html.unescape(match.group(0)))
+        else:
+            raise EntityParseError(f"can't parse entities: unescaped '{match.group(0)}' at byte offset {match.start()}")
+    if open_tags:
+        raise EntityParseError(f'can\'t parse entities: can\'t find end tag corresponding to start tag "{open_tags[-1]}"')
+    return length + utf16_length(text[position:])
+
+
+class FakeTelegramServer:
+    """Minimal local stand-in for the Telegram Bot API.
+
+    Accepts every method aiogram posts to ``/bot<token>/<method>``, records call counts
+    and payload sizes and, like the real API, rejects messages over the length limit or with
+    HTML markup that Telegram cannot parse.
+    """
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 0, enforce_limits: bool = True):
+        self.host = host
+        self.port = port
+        self.enforce_limits = enforce_limits
+        self.calls = Counter()
+        self.errors = Counter()
+        self.bytes_received = 0
+        self.documents = []
+        self._message_ids = itertools.count(1)
+        self._runner = None
+
+        self._app = web.Application(client_max_size=256 * 1024 * 1024)
+        self._app.router.add_post("/bot{token}/{method}", self._handle)
+        self._methods = {
+            "getme": self._get_me,
+            "sendmessage": self._send_message,
+            "senddocument": self._send_document,
+            "editmessagetext": self._send_message,
+        }
+
+    @property
+    def base_url(self) -> str:
+        return f"http://{self.host}:{self.port}"
+
+    async def start(self):
+        self._runner = web.AppRunner(self._app, access_log=None)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, self.host, self.port)
+        await site.start()
+        self.port = self._runner.addresses[0][1]
+
+    async def stop(self):
+        if self._runner:
+            await self._runner.cleanup()
+            self._runner = None
+
+    def reset(self):
+        self.calls.clear()
+        self.errors.clear()
+        self.bytes_received = 0
+        self.documents.clear()
+
+    def snapshot(self) -> dict:
+        return {
+            "calls": dict(self.calls),
+            "errors": dict(self.errors),
+            "bytes_received": self.bytes_received,
+            "documents": len(self.documents),
+        }
+
+    async def _handle(self, request: web.Request) -> web.Response:
+        method = request.match_info["method"]
+        params = await request.post()
+        self.calls[method] += 1
+
+        for value in params.values():
+            if isinstance(value, web.FileField):
+                self.bytes_received += len(value.file.read())
+                value.file.seek(0)
+            else:
+                self.bytes_received += len(value)
+
+        handler = self._methods.get(method.lower())
+        if handler is None:
+            return self._ok(True)
+        return handler(params)
+
+    def _ok(self, result) -> web.Response:
+        return web.json_response({"ok": True, "result": result})
+
+    def _error(self, method: str, description: str) -> web.Response:
+        self.errors[f"{method}: {description}"] += 1
+        return web.json_response({"ok": False, "error_code": 400, "description": f"Bad Request: {description}"})
+
+    def _message(self, params, **extra) -> dict:
+        message = {
+            "message_id": next(self._message_ids),
+            "date": int(time.time()),
+            "chat": {"id": int(params.get("chat_id", 0)), "type": "private"},
+        }
+        message.update(extra)
+        return message
+
+    @staticmethod
+    def _visible_length(text: str, parse_mode) -> int:
+        # Telegram applies its limits to the text after entity parsing
+        if parse_mode == "HTML":
+            return parse_html_length(text)
+        return utf16_length(text)
+
+    def _get_me(self, params) -> web.Response:
+        return self._ok({"id": 1, "is_bot": True, "first_name": "Bench", "username": "bench_bot"})
+
+    def _send_message(self, params) -> web.Response:
+        text = params.get("text", "")
+        if self.enforce_limits:
+            try:
+                length = self._visible_length(text, params.get("parse_mode"))
+            except EntityParseError as e:
+                return self._error("sendMessage", str(e))
+            if not length:
+                return self._error("sendMessage", "message text is empty")
+            if length > TELEGRAM_MESSAGE_LIMIT:
+                return self._error("sendMessage", "message is too long")
+            if "reply_markup" in params:
+                json.loads(params["reply_markup"])
+        return self._ok(self._message(params, text=text))
+
+    def _send_document(self, params) -> web.Response:
+        document = params.get("document")
+        caption = params.get("caption", "")
+        if self.enforce_limits:
+            try:
+                length = self._visible_length(caption, params.get("parse_mode"))
+            except EntityParseError as e:
+                return self._error("sendDocument", str(e))
+            if length > TELEGRAM_CAPTION_LIMIT:
+                return self._error("sendDocument", "message caption is too long")
+
+        file_name = getattr(document, "filename", None) or "document"
+        size = len(document.file.read()) if isinstance(document, web.FileField) else 0
+        self.documents.append({"file_name": file_name, "size": size})
+        return self._ok(self._message(params, document={
+            "file_id": f"doc{len(self.documents)}",
+            "file_unique_id": f"doc{len(self.documents)}",
+            "file_name": file_name,
+            "file_size": size,
+        }))
@@ -0,0 +1,408 @@
+import argparse
+import asyncio
+import json
+import logging
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import List
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+if str(REPO_ROOT) not in sys.path:
+    sys.path.insert(0, str(REPO_ROOT))
+
+from cryptography.fernet import Fernet  # noqa: E402
+
+from benchmarks.fake_ssh import FakeSSHServer  # noqa: E402
+from benchmarks.fake_telegram import FakeTelegramServer  # noqa: E402
+
+BENCH_TOKEN = "123456789:BenchmarkToken"
+ADMIN_ID = 1000
+RESTRICTED_ID = 2000
+# The restricted role may run the first generated category ("Category 0")
+RESTRICTED_COMMANDS = ["/start", "/list_servers", "/execute_command", "uptime", "df -h"] + \
+    [f"echo bench-{i}" for i in range(10)]
+BENCH_COMMAND = "echo bench-0"
+# Bump whenever roles, catalogs or scenario setup change; --compare refuses to mix versions
+FIXTURE_VERSION = 3
+
+PROFILES = {
+    "quick": {
+        "iterations": 5,
+        "server_counts": [10, 200],
+        "catalog_sizes": [7, 100],
+        "output_sizes": [1024, 64 * 1024],
+        "latencies": [0.05],
+        "fan_out": [4],
+        "middleware_iterations": 500,
+    },
+    "full": {
+        "iterations": 20,
+        "server_counts": [10, 1000, 10000],
+        "catalog_sizes": [7, 100, 1000],
+        "output_sizes": [1024, 64 * 1024, 1024 * 1024],
+        "latencies": [0.05, 0.2],
+        "fan_out": [4, 16],
+        "middleware_iterations": 5000,
+    },
+}
+
+
+def prepare_workdir(workdir: Path):
+    roles = {
+        "admin": {"users": [ADMIN_ID], "commands": []},
+        "user_btn_access": {"users": [RESTRICTED_ID], "commands": RESTRICTED_COMMANDS},
+    }
+    (workdir / "roles.json").write_text(json.dumps(roles))
+    write_catalog(workdir / "favorite_commands.xml", 7)
+
+    os.environ.update({
+        "TELEGRAM_TOKEN": BENCH_TOKEN,
+        "ENCRYPTION_KEY": Fernet.generate_key().decode(),
+        "LOGGING_LEVEL": "WARNING",
+        "LOGGING_TARGET": "1",
+        "FAVORITE_COMMANDS_FILE": str(workdir / "favorite_commands.xml"),
+    })
+    os.chdir(workdir)
+
+
+def write_catalog(path: Path, size: int, per_category: int = 10):
+    lines = ["<commands>"]
+    for start in range(0, size, per_category):
+        lines.append(f'    <category name="Category {start // per_category}">')
+        for i in range(start, min(start + per_category, size)):
+            lines.append(f"        <command><name>echo bench-{i}</name>"
+                         f"<description>Benchmark command {i}</description></command>")
+        lines.append("    </category>")
+    lines.append("</commands>")
+    path.write_text("\n".join(lines))
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], cwd=REPO_ROOT, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def summarize(samples, exceptions: int) -> dict:
+    ordered = sorted(samples)
+    to_ms = 1000.0
+    return {
+        "iterations": len(samples),
+        "exceptions": exceptions,
+        "mean_ms": statistics.fmean(ordered) * to_ms,
+        "median_ms": statistics.median(ordered) * to_ms,
+        "p95_ms": ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))] * to_ms,
+        "min_ms": ordered[0] * to_ms,
+        "max_ms": ordered[-1] * to_ms,
+    }
+
+
+class BenchmarkRunner:
+    def __init__(self, profile: dict):
+        self.profile = profile
+        self.results = []
+        self.telegram = FakeTelegramServer()
+        self.ssh = FakeSSHServer()
+        self._update_ids = iter(range(1, 10 ** 9))
+
+    async def __aenter__(self):
+        from aiogram import Bot
+        from aiogram.client.session.aiohttp import AiohttpSession
+        from aiogram.client.telegram import TelegramAPIServer
+        import main
+
+        await self.telegram.start()
+        self.ssh.start()
+        session = AiohttpSession(api=TelegramAPIServer.from_base(self.telegram.base_url))
+        self.bot = Bot(token=BENCH_TOKEN, session=session)
+        self.dp = main.dp
+        logging.getLogger().setLevel(logging.WARNING)
+        logging.getLogger("paramiko").setLevel(logging.CRITICAL)
+        await main.init_db()
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.bot.session.close()
+        await self.telegram.stop()
+        self.ssh.stop()
+
+    async def measure(self, scenario: str, case: str, params: dict, action, iterations: int = None,
+                      warmup: int = 1):
+        iterations = iterations or self.profile["iterations"]
+        for _ in range(warmup):
+            try:
+                await action()
+            except Exception:
+                pass
+
+        self.telegram.reset()
+        samples = []
+        exceptions = 0
+        for _ in range(iterations):
+            start = time.perf_counter()
+            try:
+                await action()
+            except Exception as e:
+                exceptions += 1
+                logging.debug(f"{scenario}/{case} failed: {e}")
+            samples.append(time.perf_counter() - start)
+
+        api_errors = sum(self.telegram.errors.values())
+        result = {"scenario": scenario, "case": case, "params": params, **summarize(samples, exceptions),
+                  "api_errors": api_errors, "telegram": self.telegram.snapshot()}
+        self.results.append(result)
+        print(f"{scenario:<22} {case:<34} median {result['median_ms']:>10.2f} ms  "
+              f"p95 {result['p95_ms']:>10.2f} ms  exceptions {exceptions}, api_errors {api_errors}")
+        return result
+
+    def _user(self, user_id: int) -> dict:
+        return {"id": user_id, "is_bot": False, "first_name": "Bench"}
+
+    def _message(self, user_id: int, text: str) -> dict:
+        return {"message_id": 1, "date": int(time.time()), "chat": {"id": user_id, "type": "private"},
+                "from": self._user(user_id), "text": text}
+
+    async def feed_message(self, user_id: int, text: str):
+        from aiogram.types import Update
+
+        update = Update.model_validate({"update_id": next(self._update_ids),
+                                        "message": self._message(user_id, text)}, context={"bot": self.bot})
+        await self.dp.feed_update(self.bot, update)
+
+    async def feed_callback(self, user_id: int, data: str):
+        from aiogram.types import Update
+
+        update = Update.model_validate({
+            "update_id": next(self._update_ids),
+            "callback_query": {"id": str(next(self._update_ids)), "from": self._user(user_id),
+                               "chat_instance": "bench", "data": data,
+                               "message": self._message(user_id, "Choose")},
+        }, context={"bot": self.bot})
+        await self.dp.feed_update(self.bot, update)
+
+    async def seed_servers(self, count: int, port: int = 22):
+        import aiosqlite
+        from db import encrypt_password
+
+        password = await encrypt_password("bench")
+        async with aiosqlite.connect('bot.db') as db:
+            await db.execute('DELETE FROM servers')
+            await db.executemany('INSERT INTO servers (name, ip, port, login, password) VALUES (?, ?, ?, ?, ?)',
+                                 [(f"server-{i}", "127.0.0.1", port, "bench", password) for i in range(count)])
+            await db.commit()
+            async with db.execute('SELECT id FROM servers') as cursor:
+                return [row[0] for row in await cursor.fetchall()]
+
+    async def bench_server_listing(self):
+        from command_execution import PaginationCallback
+        from config import SERVERS_PER_PAGE
+
+        for count in self.profile["server_counts"]:
+            await self.seed_servers(count)
+            params = {"servers": count, "servers_per_page": SERVERS_PER_PAGE}
+            await self.measure("list_servers", f"servers={count}", params,
+                               lambda: self.feed_message(ADMIN_ID, "/list_servers"))
+            await self.measure("execute_command_menu", f"servers={count}", params,
+                               lambda: self.feed_message(ADMIN_ID, "/execute_command"))
+            last_page = (count + SERVERS_PER_PAGE - 1) // SERVERS_PER_PAGE
+            await self.measure("server_pagination", f"servers={count},page={last_page}", params,
+                               lambda: self.feed_callback(ADMIN_ID, PaginationCallback(page=last_page).pack()))
+
+    async def bench_favorite_rendering(self):
+        from command_execution import FAVORITE_COMMANDS_FILE, FavoritesCallback, ServerCallback
+
+        server_id = (await self.seed_servers(1))[0]
+        catalog_path = Path(FAVORITE_COMMANDS_FILE)
+
+        async def select_server(user_id: int, invalidate: bool):
+            if invalidate:
+                # A new mtime makes the bot treat the catalog as changed and rebuild its keyboards
+                now = time.time_ns()
+                os.utime(catalog_path, ns=(now, now))
+            await self.feed_callback(user_id, ServerCallback(id=server_id).pack())
+
+        try:
+            for size in self.profile["catalog_sizes"]:
+                write_catalog(catalog_path, size)
+                for label, user_id in (("admin", ADMIN_ID), ("restricted", RESTRICTED_ID)):
+                    params = {"commands": size, "role": label}
+                    await self.measure("favorite_commands", f"commands={size},role={label}", params,
+                                       lambda: select_server(user_id, False))
+                    await self.measure("favorite_commands_cold", f"commands={size},role={label}", params,
+                                       lambda: select_server(user_id, True))
+                    await self.measure("favorite_category_page", f"commands={size},role={label}", params,
+                                       lambda: self.feed_callback(user_id, FavoritesCallback(
+                                           server_id=server_id, category=0, page=1).pack()))
+        finally:
+            write_catalog(Path(FAVORITE_COMMANDS_FILE), 7)
+
+    async def bench_execution(self):
+        from command_execution import CommandCallback, generate_command_id
+
+        server_id = (await self.seed_servers(1, port=self.ssh.port))[0]
+        data = CommandCallback(category="0", command=generate_command_id(BENCH_COMMAND),
+                               server_id=server_id).pack()
+        iterations = max(3, self.profile["iterations"] // 4)
+
+        for size in self.profile["output_sizes"]:
+            self.ssh.configure(latency=0.0, output_size=size)
+            await self.measure("execute_single", f"output={size}B,latency=0ms",
+                               {"output_size": size, "latency_s": 0.0},
+                               lambda: self.feed_callback(ADMIN_ID, data), iterations=iterations)
+
+        self.ssh.configure(output_size=1024)
+        for latency in self.profile["latencies"]:
+            self.ssh.configure(latency=latency)
+            await self.measure("execute_single", f"output=1024B,latency={int(latency * 1000)}ms",
+                               {"output_size": 1024, "latency_s": latency},
+                               lambda: self.feed_callback(ADMIN_ID, data), iterations=iterations)
+
+    async def bench_fan_out(self):
+        from command_execution import CommandCallback, generate_command_id
+
+        latency = self.profile["latencies"][0]
+        self.ssh.configure(latency=latency, output_size=1024)
+        command_id = generate_command_id(BENCH_COMMAND)
+        iterations = max(3, self.profile["iterations"] // 4)
+
+        for width in self.profile["fan_out"]:
+            server_ids = await self.seed_servers(width, port=self.ssh.port)
+            callbacks = [CommandCallback(category="0", command=command_id, server_id=server_id).pack()
+                         for server_id in server_ids]
+
+            async def fan_out():
+                await asyncio.gather(*(self.feed_callback(ADMIN_ID, data) for data in callbacks))
+
+            await self.measure("execute_fan_out", f"servers={width},latency={int(latency * 1000)}ms",
+                               {"servers": width, "latency_s": latency, "ideal_ms": latency * 1000},
+                               fan_out, iterations=iterations)
+
+    async def bench_middleware(self):
+        from aiogram.types import Message
+        from access_middleware import AccessMiddleware
+
+        middleware = AccessMiddleware()
+        iterations = self.profile["middleware_iterations"]
+
+        async def handler(event, data):
+            return True
+
+        for label, user_id, text in (("admin", ADMIN_ID, "/list_servers"),
+                                     ("restricted", RESTRICTED_ID, "/list_servers"),
+                                     ("restricted", RESTRICTED_ID, "plain text")):
+            event = Message.model_validate(self._message(user_id, text), context={"bot": self.bot})
+            case = f"role={label},text={text.split()[0]}"
+            await self.measure("middleware_baseline", case, {"role": label, "text": text},
+                               lambda: handler(event, {}), iterations=iterations)
+            await self.measure("middleware", case, {"role": label, "text": text},
+                               lambda: middleware(handler, event, {}), iterations=iterations)
+
+    async def run(self, scenarios):
+        for name in scenarios:
+            await getattr(self, f"bench_{name}")()
+
+
+SCENARIOS = ["server_listing", "favorite_rendering", "execution", "fan_out", "middleware"]
+
+
+def fixtures_match(current: dict, baseline: dict) -> bool:
+    versions = (baseline["meta"].get("fixture_version", 1), current["meta"]["fixture_version"])
+    if versions[0] != versions[1]:
+        print(f"\nWARNING: cannot compare against {baseline['meta']['commit'][:12]}: it used benchmark fixtures "
+              f"v{versions[0]}, this run used v{versions[1]}. Re-run the baseline commit to compare.")
+        return False
+    return True
+
+
+def failure_increases(current: dict, baseline: dict) -> List[str]:
+    increases = []
+    for key in ("exceptions", "api_errors"):
+        before, after = baseline.get(key, 0), current.get(key, 0)
+        if after > before:
+            increases.append(f"{key} {before} -> {after}")
+    return increases
+
+
+def compare(current: dict, baseline: dict, threshold: float) -> int:
+    previous = {(r["scenario"], r["case"]): r for r in baseline["results"]}
+    regressions = 0
+    print(f"\nComparison against {baseline['meta']['commit'][:12]} (median, threshold {threshold:.0%}):")
+    for result in current["results"]:
+        old = previous.get((result["scenario"], result["case"]))
+        if not old:
+            continue
+        # A handler that starts failing usually gets faster, so more failures always count as a regression
+        increases = failure_increases(result, old)
+        failures = result.get("exceptions", 0) + result.get("api_errors", 0)
+        change = (result["median_ms"] - old["median_ms"]) / old["median_ms"] if old["median_ms"] else 0.0
+        if increases:
+            marker = f"REGRESSION ({', '.join(increases)})"
+        elif change > threshold:
+            marker = "REGRESSION"
+        elif failures:
+            marker = f"failing ({failures} failures, timings measure the error path)"
+        else:
+            marker = ""
+        regressions += marker.startswith("REGRESSION")
+        print(f"{result['scenario']:<22} {result['case']:<34} {old['median_ms']:>10.2f} -> "
+              f"{result['median_ms']:>10.2f} ms ({change:+.1%}) {marker}")
+    return regressions
+
+
+async def run_benchmarks(args) -> dict:
+    profile = PROFILES[args.profile]
+    started = datetime.now(timezone.utc).isoformat()
+    async with BenchmarkRunner(profile) as runner:
+        await runner.run(args.scenario or SCENARIOS)
+    return {
+        "meta": {
+            "commit": git_commit(),
+            "started_at": started,
+            "profile": args.profile,
+            "fixture_version": FIXTURE_VERSION,
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+        },
+        "results": runner.results,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the bot against local Telegram and SSH stand-ins.")
+    parser.add_argument("--profile", choices=sorted(PROFILES), default="quick")
+    parser.add_argument("--scenario", choices=SCENARIOS, action="append",
+                        help="Scenario to run (repeatable, default: all)")
+    parser.add_argument("--output", default="bench_results.json", help="Where to write the JSON results")
+    parser.add_argument("--compare", help="Previous results file to compare medians against")
+    parser.add_argument("--threshold", type=float, default=0.2,
+                        help="Relative median slowdown reported as a regression (default: 0.2)")
+    args = parser.parse_args()
+
+    output = Path(args.output).resolve()
+    baseline = json.loads(Path(args.compare).read_text()) if args.compare else None
+
+    with tempfile.TemporaryDirectory(prefix="bot-bench-") as workdir:
+        prepare_workdir(Path(workdir))
+        results = asyncio.run(run_benchmarks(args))
+
+    output.write_text(json.dumps(results, indent=2))
+    print(f"\nResults written to {output}")
+
+    if baseline:
+        if not fixtures_match(results, baseline):
+            sys.exit(2)
+        if compare(results, baseline, args.threshold):
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
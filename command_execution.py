@@ -1,26 +1,38 @@
 import os
+import asyncio
 import logging
+import select
+import time
 from dotenv import load_dotenv
 from fabric import Connection
 from aiogram import types, Dispatcher
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
 from aiogram.filters import Command
-from aiogram.utils.keyboard import InlineKeyboardBuilder
 from aiogram.filters.callback_data import CallbackData
+from aiogram.exceptions import TelegramBadRequest
 import re
 import xml.etree.ElementTree as ET
 import hashlib
+import html
 import aiosqlite
-from config import SERVERS_PER_PAGE
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Tuple
+from config import SERVERS_PER_PAGE, COMMANDS_PER_PAGE
 from db import decrypt_password
+from output_policy import OutputPolicy, CommandOutput, get_output_policy, render_output
+from user import User, ROLES_FILE
 
 load_dotenv()
 FAVORITE_COMMANDS_FILE = os.getenv("FAVORITE_COMMANDS_FILE", "favorite_commands.xml")
 COMMAND_TIMEOUT = int(os.getenv("COMMAND_TIMEOUT", "10"))
 TELEGRAM_MESSAGE_CHUNK_SIZE = int(os.getenv("TELEGRAM_MESSAGE_CHUNK_SIZE", "4096"))
-
-COMMAND_MAP = {}
+SSH_RECV_BUFFER_SIZE = 32768
+KEYBOARD_CACHE_SIZE = 512
+CATEGORY_LIST = -1
+OUTPUT_HEADER_NAME_LENGTH = 64
+OUTPUT_HEADER_COMMAND_LENGTH = 256
 
 class ServerCallback(CallbackData, prefix="server"):
     id: int
@@ -33,6 +45,11 @@ class CommandCallback(CallbackData, prefix="command"):
 class PaginationCallback(CallbackData, prefix="page"):
     page: int
 
+class FavoritesCallback(CallbackData, prefix="favorites"):
+    server_id: int
+    category: int
+    page: int
+
 class CommandForm(StatesGroup):
     server_id = State()
     command = State()
@@ -40,10 +57,23 @@ class CommandForm(StatesGroup):
 class ManualCommandForm(StatesGroup):
     command = State()
 
+@dataclass
+class RoleCatalog:
+    # (category name, [(command id, command, description)]) for the commands a role may run
+    categories: List[Tuple[str, List[Tuple[str, str, str]]]] = field(default_factory=list)
+    commands: Dict[str, str] = field(default_factory=dict)
+
+    @property
+    def size(self) -> int:
+        return len(self.commands)
+
+_catalog_version = None
+_favorite_commands = None
+_role_catalogs: Dict[Optional[str], RoleCatalog] = {}
+_keyboard_cache: "OrderedDict[tuple, Tuple[str, types.InlineKeyboardMarkup]]" = OrderedDict()
+
 def generate_command_id(command: str) -> str:
-    command_id = hashlib.md5(command.encode()).hexdigest()[:8]
-    COMMAND_MAP[command_id] = command
-    return command_id
+    return hashlib.md5(command.encode()).hexdigest()[:8]
 
 async def load_servers(db):
     async with db.execute('SELECT id, name, ip FROM servers') as cursor:
@@ -117,46 +147,218 @@ async def load_favorite_commands():
 
     return commands
 
-async def show_favorite_commands(message: types.Message, server_id: int):
+def get_catalog_version() -> tuple:
+    version = []
+    for path in (FAVORITE_COMMANDS_FILE, ROLES_FILE):
+        try:
+            stat = os.stat(path)
+            version.append((path, stat.st_mtime_ns, stat.st_size))
+        except OSError:
+            version.append((path, None, None))
+    return tuple(version)
+
+async def get_role_catalog(role: Optional[str]) -> RoleCatalog:
+    global _catalog_version, _favorite_commands
+    version = get_catalog_version()
+    if version != _catalog_version:
+        logging.info("Favorite commands or roles changed, rebuilding command keyboards")
+        _favorite_commands = None
+        _role_catalogs.clear()
+        _keyboard_cache.clear()
+        _catalog_version = version
+
+    if role in _role_catalogs:
+        return _role_catalogs[role]
+
+    if _favorite_commands is None:
+        _favorite_commands = await load_favorite_commands()
+
+    allowed = None
+    if role != 'admin':
+        allowed = set(User.load_roles().get(role, {}).get('commands', [])) if role else set()
+
+    catalog = RoleCatalog()
+    for category, category_commands in _favorite_commands.items():
+        visible = [(generate_command_id(command), command, description)
+                   for command, description in category_commands
+                   if allowed is None or command in allowed]
+        if visible:
+            catalog.categories.append((category, visible))
+            catalog.commands.update((command_id, command) for command_id, command, _ in visible)
+
+    _role_catalogs[role] = catalog
+    return catalog
+
+def _manual_button(server_id: int) -> types.InlineKeyboardButton:
+    return types.InlineKeyboardButton(
+        text="Enter command manually",
+        callback_data=CommandCallback(category='manual', command='manual', server_id=server_id).pack()
+    )
+
+def _page_count(items: int) -> int:
+    return max(1, (items + COMMANDS_PER_PAGE - 1) // COMMANDS_PER_PAGE)
+
+def _normalize_menu(catalog: RoleCatalog, category: int, page: int) -> Tuple[int, int]:
+    if catalog.size <= COMMANDS_PER_PAGE:
+        return CATEGORY_LIST, 1
+    if not 0 <= category < len(catalog.categories):
+        category = CATEGORY_LIST
+    items = len(catalog.categories) if category == CATEGORY_LIST else len(catalog.categories[category][1])
+    return category, min(max(page, 1), _page_count(items))
+
+def _page_buttons(server_id: int, category: int, page: int, total_pages: int) -> List[types.InlineKeyboardButton]:
+    buttons = []
+    if page > 1:
+        buttons.append(types.InlineKeyboardButton(
+            text="Previous", callback_data=FavoritesCallback(server_id=server_id, category=category, page=page - 1).pack()))
+    if page < total_pages:
+        buttons.append(types.InlineKeyboardButton(
+            text="Next", callback_data=FavoritesCallback(server_id=server_id, category=category, page=page + 1).pack()))
+    return buttons
+
+def _build_favorites_menu(catalog: RoleCatalog, server_id: int, category: int, page: int) -> Tuple[str, types.InlineKeyboardMarkup]:
+    rows = []
+    if catalog.size <= COMMANDS_PER_PAGE:
+        text = "Choose a command to execute:"
+        for index, (_, commands) in enumerate(catalog.categories):
+            rows.extend([types.InlineKeyboardButton(
+                text=f"{command} - {description}",
+                callback_data=CommandCallback(category=str(index), command=command_id, server_id=server_id).pack()
+            )] for command_id, command, description in commands)
+        rows.append([_manual_button(server_id)])
+        return text, types.InlineKeyboardMarkup(inline_keyboard=rows)
+
+    if category == CATEGORY_LIST:
+        total_pages = _page_count(len(catalog.categories))
+        text = f"Choose a command category (Page {page}/{total_pages}):"
+        items = list(enumerate(catalog.categories))
+        for index, (name, commands) in items[(page - 1) * COMMANDS_PER_PAGE:page * COMMANDS_PER_PAGE]:
+            rows.append([types.InlineKeyboardButton(
+                text=f"{name} ({len(commands)})",
+                callback_data=FavoritesCallback(server_id=server_id, category=index, page=1).pack()
+            )])
+    else:
+        name, commands = catalog.categories[category]
+        total_pages = _page_count(len(commands))
+        text = f"{name} (Page {page}/{total_pages}):"
+        for command_id, command, description in commands[(page - 1) * COMMANDS_PER_PAGE:page * COMMANDS_PER_PAGE]:
+            rows.append([types.InlineKeyboardButton(
+                text=f"{command} - {description}",
+                callback_data=CommandCallback(category=str(category), command=command_id, server_id=server_id).pack()
+            )])
+
+    pagination_buttons = _page_buttons(server_id, category, page, total_pages)
+    if pagination_buttons:
+        rows.append(pagination_buttons)
+    if category != CATEGORY_LIST:
+        rows.append([types.InlineKeyboardButton(
+            text="Back to categories",
+            callback_data=FavoritesCallback(server_id=server_id, category=CATEGORY_LIST, page=1).pack()
+        )])
+    rows.append([_manual_button(server_id)])
+    return text, types.InlineKeyboardMarkup(inline_keyboard=rows)
+
+async def get_favorites_menu(role: Optional[str], server_id: int, category: int = CATEGORY_LIST,
+                             page: int = 1) -> Tuple[str, types.InlineKeyboardMarkup]:
+    catalog = await get_role_catalog(role)
+    category, page = _normalize_menu(catalog, category, page)
+    key = (role, server_id, category, page)
+    menu = _keyboard_cache.get(key)
+    if menu is None:
+        menu = _build_favorites_menu(catalog, server_id, category, page)
+        _keyboard_cache[key] = menu
+        if len(_keyboard_cache) > KEYBOARD_CACHE_SIZE:
+            _keyboard_cache.popitem(last=False)
+    else:
+        _keyboard_cache.move_to_end(key)
+    return menu
+
+async def show_favorite_commands(message: types.Message, server_id: int, role: Optional[str]):
     try:
-        commands = await load_favorite_commands()
+        text, keyboard = await get_favorites_menu(role, server_id)
     except Exception as e:
         logging.exception("Unexpected error while parsing favorite commands")
-        await message.reply(f"{str(e)}. Enter command manually:")
+        await message.reply(f"{str(e)}. Enter command manually:",
+                            reply_markup=types.InlineKeyboardMarkup(inline_keyboard=[[_manual_button(server_id)]]))
         return
 
-    builder = InlineKeyboardBuilder()
-    for category, category_commands in commands.items():
-        for command, description in category_commands:
-            command_id = generate_command_id(command)
-            builder.button(
-                text=f"{command} - {description}",
-                callback_data=CommandCallback(category=category, command=command_id, server_id=server_id).pack()
-            )
-
-    builder.button(
-        text="Enter command manually",
-        callback_data=CommandCallback(category='manual', command='manual', server_id=server_id).pack()
-    )
+    await message.reply(text, reply_markup=keyboard)
 
-    builder.adjust(1)
-    await message.reply("Choose a command to execute:", reply_markup=builder.as_markup())
+def read_command_output(conn: Connection, command: str, policy: OutputPolicy) -> CommandOutput:
+    conn.open()
+    channel = conn.client.get_transport().open_session()
+    try:
+        channel.exec_command(command)
+        deadline = time.monotonic() + COMMAND_TIMEOUT
+        streams = {'stdout': bytearray(), 'stderr': bytearray()}
+        bytes_read = 0
+        truncated = False
+
+        # Read both streams ourselves instead of conn.run() so at most max_output_bytes are kept
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise TimeoutError(f"Command timed out after {COMMAND_TIMEOUT} seconds")
+            select.select([channel], [], [], min(remaining, 1.0))
+
+            for name, ready, recv in (('stdout', channel.recv_ready, channel.recv),
+                                      ('stderr', channel.recv_stderr_ready, channel.recv_stderr)):
+                while ready() and not truncated:
+                    data = recv(SSH_RECV_BUFFER_SIZE)
+                    allowed = policy.max_output_bytes - bytes_read
+                    streams[name] += data[:allowed]
+                    bytes_read += min(len(data), allowed)
+                    truncated = len(data) > allowed
+
+            if truncated:
+                break
+            if (channel.eof_received or channel.closed) and not channel.recv_ready() and not channel.recv_stderr_ready():
+                channel.status_event.wait(max(0.0, deadline - time.monotonic()))
+                break
+
+        exit_status = channel.exit_status if channel.exit_status_ready() else None
+        output = CommandOutput(stdout=streams['stdout'].decode(errors='replace'),
+                               stderr=streams['stderr'].decode(errors='replace'),
+                               bytes_read=bytes_read, truncated=truncated, exit_status=exit_status)
+        logging.info(f"Command '{command}' finished with status {exit_status}, {bytes_read} bytes read, truncated: {truncated}")
+        return output
+    finally:
+        channel.close()
+
+async def execute_command_with_timeout(conn: Connection, command: str, policy: OutputPolicy) -> CommandOutput:
+    logging.info(f"Executing command '{command}' with timeout {COMMAND_TIMEOUT} seconds")
+    # The SSH connection and read loop block, so keep them off the event loop
+    return await asyncio.to_thread(read_command_output, conn, command, policy)
+
+def _shorten(text: str, length: int) -> str:
+    return text if len(text) <= length else text[:length - 1] + "…"
+
+async def reply_with_command_output(message: types.Message, conn: Connection, command: str, role: str, server_name: str):
+    policy = get_output_policy(role)
+    # Name the server so output from several servers in one chat can be told apart
+    header = (f"<b>{html.escape(_shorten(server_name, OUTPUT_HEADER_NAME_LENGTH), quote=False)}</b>: "
+              f"<code>{html.escape(_shorten(command, OUTPUT_HEADER_COMMAND_LENGTH), quote=False)}</code>")
+    try:
+        output = await execute_command_with_timeout(conn, command, policy)
+    except Exception as e:
+        await message.reply(f"Failed to execute command on {server_name}: {str(e)}")
+        return
 
-async def execute_command_with_timeout(conn: Connection, command: str):
+    rendered = render_output(output, policy, TELEGRAM_MESSAGE_CHUNK_SIZE, header)
     try:
-        logging.info(f"Executing command '{command}' with timeout {COMMAND_TIMEOUT} seconds")
-        result = conn.run(command, hide=True, warn=True, timeout=COMMAND_TIMEOUT)
-        stdout = result.stdout.strip()
-        stderr = result.stderr.strip()
-        output = f"```{stdout}```\n" if stdout else ""
-        output += f"```{stderr}```" if stderr else ""
-        logging.info(f"Command stdout: {stdout}")
-        logging.info(f"Command stderr: {stderr}")
-
-        chunks = [output[i:i+TELEGRAM_MESSAGE_CHUNK_SIZE] for i in range(0, len(output), TELEGRAM_MESSAGE_CHUNK_SIZE)]
-        return chunks
+        for chunk in rendered.messages:
+            await message.reply(chunk, parse_mode="HTML")
+        if rendered.document is not None:
+            await message.reply_document(
+                types.BufferedInputFile(rendered.document, filename=rendered.document_name),
+                caption=rendered.document_caption
+            )
     except Exception as e:
-        return [f"Failed to execute command: {str(e)}"]
+        logging.exception(f"Failed to send output of command '{command}'")
+        try:
+            await message.reply(f"Failed to send command output: {str(e)}")
+        except Exception:
+            logging.exception("Failed to report the send failure")
 
 async def process_command_selection(callback_query: types.CallbackQuery, callback_data: CommandCallback, state: FSMContext):
     server_id = callback_data.server_id
@@ -169,22 +371,29 @@ async def process_command_selection(callback_query: types.CallbackQuery, callbac
         await callback_query.answer()
         return
 
-    command = COMMAND_MAP.get(command_id)
+    role = User.get_user_role(callback_query.from_user.id)
+    try:
+        catalog = await get_role_catalog(role)
+    except Exception as e:
+        await callback_query.message.reply(f"{str(e)}")
+        await callback_query.answer()
+        return
+
+    command = catalog.commands.get(command_id)
+    if command is None:
+        await callback_query.message.reply("This command is not allowed.")
+        await callback_query.answer()
+        return
 
     async with aiosqlite.connect('bot.db') as db:
-        async with db.execute('SELECT ip, port, login, password FROM servers WHERE id = ?', (server_id,)) as cursor:
+        async with db.execute('SELECT name, ip, port, login, password FROM servers WHERE id = ?', (server_id,)) as cursor:
             server = await cursor.fetchone()
             if server:
-                ip, port, login, password = server
+                name, ip, port, login, password = server
                 password = await decrypt_password(password)
                 conn = Connection(host=ip, user=login, port=port, connect_kwargs={"password": password})
                 try:
-                    output_chunks = await execute_command_with_timeout(conn, command)
-                    formatted_output_chunks = [f"<pre><code>{chunk.strip('`')}</code></pre>" for chunk in output_chunks]
-                    for chunk in formatted_output_chunks:
-                        await callback_query.message.reply(chunk, parse_mode="HTML")
-                except Exception as e:
-                    await callback_query.message.reply(f"Failed to execute command: {str(e)}")
+                    await reply_with_command_output(callback_query.message, conn, command, role, name or ip)
                 finally:
                     conn.close()
 
@@ -215,34 +424,27 @@ async def process_manual_command_input(message: types.Message, state: FSMContext
         await message.reply("Invalid characters in command.")
         return
 
-    user = data.get('user')
-    if user and user.role != 'admin':
+    role = User.get_user_role(message.from_user.id)
+    if role != 'admin':
         try:
-            allowed_commands = [command_elem.text.strip() for command_elem in ET.parse(FAVORITE_COMMANDS_FILE).getroot().findall('.//command/name') if command_elem.text]
-            if not allowed_commands:
-                raise ValueError("No valid commands found in the XML file")
+            catalog = await get_role_catalog(role)
         except Exception as e:
             await message.reply(f"{str(e)}")
             return
 
-        if command not in allowed_commands:
+        if command not in catalog.commands.values():
             await message.reply("This command is not allowed.")
             return
 
     async with aiosqlite.connect('bot.db') as db:
-        async with db.execute('SELECT ip, port, login, password FROM servers WHERE id = ?', (server_id,)) as cursor:
+        async with db.execute('SELECT name, ip, port, login, password FROM servers WHERE id = ?', (server_id,)) as cursor:
             server = await cursor.fetchone()
             if server:
-                ip, port, login, password = server
+                name, ip, port, login, password = server
                 password = await decrypt_password(password)
                 conn = Connection(host=ip, user=login, port=port, connect_kwargs={"password": password})
                 try:
-                    output_chunks = await execute_command_with_timeout(conn, command)
-                    formatted_output_chunks = [f"<pre><code>{chunk.strip('`')}</code></pre>" for chunk in output_chunks]
-                    for chunk in formatted_output_chunks:
-                        await message.reply(chunk, parse_mode="HTML")
-                except Exception as e:
-                    await message.reply(f"Failed to execute command: {str(e)}")
+                    await reply_with_command_output(message, conn, command, role, name or ip)
                 finally:
                     conn.close()
 
@@ -250,7 +452,25 @@ async def process_manual_command_input(message: types.Message, state: FSMContext
 
 async def process_server_selection(callback_query: types.CallbackQuery, callback_data: ServerCallback, state: FSMContext):
     await state.update_data(server_id=callback_data.id)
-    await show_favorite_commands(callback_query.message, callback_data.id)
+    role = User.get_user_role(callback_query.from_user.id)
+    await show_favorite_commands(callback_query.message, callback_data.id, role)
+    await callback_query.answer()
+
+async def process_favorites_navigation(callback_query: types.CallbackQuery, callback_data: FavoritesCallback):
+    role = User.get_user_role(callback_query.from_user.id)
+    try:
+        text, keyboard = await get_favorites_menu(role, callback_data.server_id, callback_data.category,
+                                                  callback_data.page)
+    except Exception as e:
+        logging.exception("Unexpected error while parsing favorite commands")
+        await callback_query.message.reply(f"{str(e)}")
+    else:
+        try:
+            await callback_query.message.edit_text(text, reply_markup=keyboard)
+        except TelegramBadRequest as e:
+            # A stale button can point at the page already shown
+            if "message is not modified" not in str(e):
+                logging.warning(f"Failed to update favorite commands menu: {e}")
     await callback_query.answer()
 
 async def process_pagination(callback_query: types.CallbackQuery, callback_data: PaginationCallback, state: FSMContext):
@@ -263,4 +483,5 @@ def register_handlers_command_execution(dp: Dispatcher):
     dp.callback_query.register(process_manual_command, lambda c: c.data.startswith("command:manual"))
     dp.message.register(process_manual_command_input, ManualCommandForm.command)
     dp.callback_query.register(process_pagination, PaginationCallback.filter())
-    dp.callback_query.register(process_server_selection, ServerCallback.filter())
\ No newline at end of file
+    dp.callback_query.register(process_server_selection, ServerCallback.filter())
+    dp.callback_query.register(process_favorites_navigation, FavoritesCallback.filter())
\ No newline at end of file
@@ -17,3 +17,8 @@ LOGGING_LEVEL = get_env_variable('LOGGING_LEVEL', 'INFO')
 LOGGING_TARGET = int(get_env_variable('LOGGING_TARGET', 3))  # 1 - file, 2 - console, 3 - both
 ALLOWED_TELEGRAM_IDS = {int(x) for x in get_env_variable('ALLOWED_TELEGRAM_IDS', '').split(',') if x.isdigit()}
 SERVERS_PER_PAGE = int(get_env_variable('SERVERS_PER_PAGE', '20'))
+COMMANDS_PER_PAGE = int(get_env_variable('COMMANDS_PER_PAGE', '10'))
+OUTPUT_MAX_BYTES = int(get_env_variable('OUTPUT_MAX_BYTES', str(5 * 1024 * 1024)))
+OUTPUT_INLINE_MESSAGES = int(get_env_variable('OUTPUT_INLINE_MESSAGES', '3'))
+OUTPUT_PREVIEW_LINES = int(get_env_variable('OUTPUT_PREVIEW_LINES', '15'))
+OUTPUT_ATTACH_FULL = get_env_variable('OUTPUT_ATTACH_FULL', 'true').lower() in ('1', 'true', 'yes')
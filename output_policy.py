@@ -0,0 +1,194 @@
+import dataclasses
+import gzip
+import html
+import logging
+from dataclasses import dataclass
+from typing import List, Optional
+
+from config import OUTPUT_MAX_BYTES, OUTPUT_INLINE_MESSAGES, OUTPUT_PREVIEW_LINES, OUTPUT_ATTACH_FULL
+from user import User
+
+PRE_OPEN = "<pre><code>"
+PRE_CLOSE = "</code></pre>"
+PREVIEW_MARKER_RESERVE = 120
+TRUE_VALUES = ('1', 'true', 'yes')
+FALSE_VALUES = ('0', 'false', 'no')
+OUTPUT_SETTING_MINIMUMS = {'max_output_bytes': 1, 'inline_messages': 1, 'preview_lines': 1}
+
+
+@dataclass(frozen=True)
+class OutputPolicy:
+    max_output_bytes: int = OUTPUT_MAX_BYTES
+    inline_messages: int = OUTPUT_INLINE_MESSAGES
+    preview_lines: int = OUTPUT_PREVIEW_LINES
+    attach_full_output: bool = OUTPUT_ATTACH_FULL
+
+
+@dataclass
+class CommandOutput:
+    stdout: str
+    stderr: str
+    bytes_read: int
+    truncated: bool = False
+    exit_status: Optional[int] = None
+
+    @property
+    def text(self) -> str:
+        stdout = self.stdout.strip()
+        stderr = self.stderr.strip()
+        if stdout and stderr:
+            return f"{stdout}\n\n[stderr]\n{stderr}"
+        return stdout or stderr
+
+
+@dataclass
+class RenderedOutput:
+    messages: List[str]
+    document: Optional[bytes] = None
+    document_name: str = "output.log.gz"
+    document_caption: str = ""
+
+
+def _convert_setting(name: str, kind: type, value):
+    if kind is bool:
+        if isinstance(value, bool):
+            return value
+        if isinstance(value, str) and value.lower() in TRUE_VALUES + FALSE_VALUES:
+            return value.lower() in TRUE_VALUES
+        raise ValueError("expected true or false")
+
+    if isinstance(value, bool) or (isinstance(value, float) and not value.is_integer()):
+        raise ValueError("expected an integer")
+    converted = int(value)
+    minimum = OUTPUT_SETTING_MINIMUMS.get(name)
+    if minimum is not None and converted < minimum:
+        raise ValueError(f"must be at least {minimum}")
+    return converted
+
+
+def get_output_policy(role: Optional[str]) -> OutputPolicy:
+    policy = OutputPolicy()
+    if not role:
+        return policy
+
+    overrides = User.load_roles().get(role, {}).get('output', {})
+    if not isinstance(overrides, dict):
+        logging.warning(f"Ignoring output settings for role '{role}': expected an object")
+        return policy
+
+    kinds = {field.name: field.type for field in dataclasses.fields(OutputPolicy)}
+    values = {}
+    for key, value in overrides.items():
+        if key not in kinds:
+            logging.warning(f"Ignoring unknown output setting '{key}' for role '{role}'")
+            continue
+        try:
+            values[key] = _convert_setting(key, kinds[key], value)
+        except (TypeError, ValueError) as e:
+            logging.warning(f"Ignoring invalid output setting '{key}'={value!r} for role '{role}': {e}")
+    return dataclasses.replace(policy, **values)
+
+
+def telegram_length(text: str) -> int:
+    """Length of text as Telegram counts it, in UTF-16 code units."""
+    return len(text.encode('utf-16-le')) // 2
+
+
+def _escape_and_split(line: str, budget: int) -> List[str]:
+    escaped = html.escape(line, quote=False)
+    if telegram_length(escaped) <= budget:
+        return [escaped]
+
+    # Split an overlong line between characters so no HTML entity is cut in half
+    pieces, current, size = [], [], 0
+    for char in line:
+        escaped_char = html.escape(char, quote=False)
+        char_size = telegram_length(escaped_char)
+        if current and size + char_size > budget:
+            pieces.append("".join(current))
+            current, size = [], 0
+        current.append(escaped_char)
+        size += char_size
+    if current:
+        pieces.append("".join(current))
+    return pieces
+
+
+def split_message_lines(text: str, budget: int) -> List[str]:
+    """Escape text for HTML and split it on line boundaries into pieces of at most budget UTF-16 code units."""
+    chunks, current, size = [], [], 0
+    for line in text.split("\n"):
+        for piece in _escape_and_split(line, budget):
+            piece_size = telegram_length(piece)
+            added = piece_size + (1 if current else 0)
+            if current and size + added > budget:
+                chunks.append("\n".join(current))
+                current, size, added = [], 0, piece_size
+            current.append(piece)
+            size += added
+    if current:
+        chunks.append("\n".join(current))
+    return chunks
+
+
+def _build_preview(text: str, policy: OutputPolicy, limit: int) -> str:
+    lines = text.split("\n")
+    count = max(1, policy.preview_lines)
+    half = (limit - PREVIEW_MARKER_RESERVE - 2 * (len(PRE_OPEN) + len(PRE_CLOSE))) // 2
+
+    # With few (long) lines, head and tail are cut from the text itself so they never overlap
+    by_lines = len(lines) > 2 * count
+    head_source = "\n".join(lines[:count]) if by_lines else text
+    # Escaping and UTF-16 encoding never shorten text, so trimming the raw text first bounds the work on huge lines
+    head = split_message_lines(head_source[:half], half)[0]
+    shown_head = len(html.unescape(head))
+
+    tail_source = "\n".join(lines[-count:]) if by_lines else text[shown_head:]
+    tail = split_message_lines(tail_source[-half:], half)[-1] if tail_source else ""
+    shown_tail = len(html.unescape(tail))
+
+    if by_lines and shown_head == len(head_source) and shown_tail == len(tail_source):
+        marker = f"… {len(lines) - 2 * count} of {len(lines)} lines omitted …"
+    else:
+        marker = f"… {len(text) - shown_head - shown_tail} of {len(text)} characters omitted …"
+    preview = f"{PRE_OPEN}{head}{PRE_CLOSE}\n<i>{marker}</i>"
+    if tail:
+        preview += f"\n{PRE_OPEN}{tail}{PRE_CLOSE}"
+    return preview
+
+
+def render_output(output: CommandOutput, policy: OutputPolicy, limit: int, header: str = "") -> RenderedOutput:
+    """Render command output as Telegram HTML messages, with header (HTML) on its own line in the first one."""
+    rendered = _render_text(output, policy, limit - (telegram_length(header) + 1 if header else 0))
+    if header:
+        rendered.messages[0] = f"{header}\n{rendered.messages[0]}"
+    return rendered
+
+
+def _render_text(output: CommandOutput, policy: OutputPolicy, limit: int) -> RenderedOutput:
+    text = output.text
+    if not text:
+        return RenderedOutput(["Command completed with no output."])
+
+    budget = limit - len(PRE_OPEN) - len(PRE_CLOSE)
+    chunks = None
+    # Code points are a lower bound on the escaped UTF-16 length, so longer text can never fit inline
+    if len(text) <= budget * policy.inline_messages:
+        chunks = split_message_lines(text, budget)
+
+    if chunks is not None and len(chunks) <= policy.inline_messages:
+        rendered = RenderedOutput([f"{PRE_OPEN}{chunk}{PRE_CLOSE}" for chunk in chunks])
+    else:
+        rendered = RenderedOutput([_build_preview(text, policy, limit)])
+        if policy.attach_full_output:
+            rendered.document = gzip.compress(f"{text}\n".encode())
+            if output.truncated:
+                rendered.document_name = "output-truncated.log.gz"
+                rendered.document_caption = (f"First {output.bytes_read} bytes of output, truncated at the "
+                                             f"{policy.max_output_bytes}-byte limit (gzip-compressed)")
+            else:
+                rendered.document_caption = f"Full output ({output.bytes_read} bytes, gzip-compressed)"
+
+    if output.truncated:
+        rendered.messages.append(f"<i>Output truncated at {policy.max_output_bytes} bytes.</i>")
+    return rendered
@@ -0,0 +1,13 @@
+import os
+import sys
+from pathlib import Path
+
+from cryptography.fernet import Fernet
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+if str(REPO_ROOT) not in sys.path:
+    sys.path.insert(0, str(REPO_ROOT))
+
+# config.py refuses to import without these
+os.environ.setdefault("TELEGRAM_TOKEN", "123456789:TestToken")
+os.environ.setdefault("ENCRYPTION_KEY", Fernet.generate_key().decode())
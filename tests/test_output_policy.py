@@ -0,0 +1,173 @@
+import gzip
+import html
+
+import pytest
+
+from benchmarks.fake_telegram import TELEGRAM_MESSAGE_LIMIT, parse_html_length
+from output_policy import (PRE_CLOSE, PRE_OPEN, CommandOutput, OutputPolicy, _build_preview,
+                           _convert_setting, render_output, split_message_lines, telegram_length)
+
+LIMIT = TELEGRAM_MESSAGE_LIMIT
+BUDGET = LIMIT - len(PRE_OPEN) - len(PRE_CLOSE)
+
+TEXTS = {
+    "huge_line": "x" * 50_000,
+    "markup": "\n".join("<tag> & </tag> && <<>>" * 20 for _ in range(200)),
+    "few_long_lines": "\n".join(chr(ord("a") + i) * 9_000 for i in range(3)),
+    "non_bmp": "\n".join(f"✅ ok 😀 {i} " + "😀" * 10 for i in range(500)),
+    "non_bmp_line": "😀" * 10_000,
+}
+
+
+def assert_sendable(message: str):
+    # Telegram rejects markup it cannot parse and counts the limit in UTF-16 code units
+    assert parse_html_length(message) <= LIMIT
+    assert telegram_length(message) <= LIMIT
+
+
+@pytest.mark.parametrize("name", TEXTS)
+def test_split_message_lines_fits_budget(name):
+    text = TEXTS[name]
+    chunks = split_message_lines(text, BUDGET)
+
+    assert html.unescape("\n".join(chunks)).replace("\n", "") == text.replace("\n", "")
+    for chunk in chunks:
+        assert telegram_length(chunk) <= BUDGET
+        assert_sendable(f"{PRE_OPEN}{chunk}{PRE_CLOSE}")
+
+
+def test_split_message_lines_keeps_entities_whole():
+    chunks = split_message_lines("&" * 1000, 7)
+
+    assert all(chunk == "&amp;" for chunk in chunks)
+    assert len(chunks) == 1000
+
+
+@pytest.mark.parametrize("name", TEXTS)
+@pytest.mark.parametrize("preview_lines", [1, 5, 10_000])
+def test_build_preview_fits_limit(name, preview_lines):
+    text = TEXTS[name]
+    preview = _build_preview(text, OutputPolicy(preview_lines=preview_lines), LIMIT)
+
+    assert_sendable(preview)
+    assert "omitted" in preview
+
+
+def test_build_preview_counts_omitted_lines():
+    text = "\n".join(f"line {i}" for i in range(100))
+    preview = _build_preview(text, OutputPolicy(preview_lines=10), LIMIT)
+
+    assert "80 of 100 lines omitted" in preview
+    assert f"line 9{PRE_CLOSE}" in preview and f"{PRE_OPEN}line 90\n" in preview
+    assert "line 10\n" not in preview and "line 89\n" not in preview
+
+
+def test_build_preview_head_and_tail_do_not_overlap():
+    text = "".join(chr(ord("a") + i % 26) for i in range(10_000))
+    preview = _build_preview(text, OutputPolicy(preview_lines=50), LIMIT)
+    head, tail = (part.split(PRE_CLOSE)[0] for part in preview.split(PRE_OPEN)[1:])
+
+    assert text.startswith(head) and text.endswith(tail)
+    assert f"{len(text) - len(head) - len(tail)} of {len(text)} characters omitted" in preview
+
+
+@pytest.mark.parametrize("name", TEXTS)
+@pytest.mark.parametrize("inline_messages", [1, 3])
+def test_render_output_messages_are_sendable(name, inline_messages):
+    text = TEXTS[name]
+    output = CommandOutput(stdout=text, stderr="", bytes_read=len(text.encode()))
+    rendered = render_output(output, OutputPolicy(inline_messages=inline_messages), LIMIT)
+
+    assert 1 <= len(rendered.messages) <= inline_messages
+    for message in rendered.messages:
+        assert_sendable(message)
+
+
+def test_render_output_inline_when_it_fits():
+    output = CommandOutput(stdout="a < b\n", stderr="oops & more", bytes_read=17)
+    rendered = render_output(output, OutputPolicy(), LIMIT)
+
+    assert rendered.messages == [f"{PRE_OPEN}a &lt; b\n\n[stderr]\noops &amp; more{PRE_CLOSE}"]
+    assert rendered.document is None
+
+
+def test_render_output_attaches_full_output():
+    text = TEXTS["non_bmp"]
+    output = CommandOutput(stdout=text, stderr="", bytes_read=len(text.encode()))
+    rendered = render_output(output, OutputPolicy(inline_messages=1), LIMIT)
+
+    assert len(rendered.messages) == 1
+    assert gzip.decompress(rendered.document).decode() == f"{text}\n"
+    assert rendered.document_name == "output.log.gz"
+
+
+def test_render_output_without_attachment():
+    text = TEXTS["huge_line"]
+    output = CommandOutput(stdout=text, stderr="", bytes_read=len(text))
+    rendered = render_output(output, OutputPolicy(inline_messages=1, attach_full_output=False), LIMIT)
+
+    assert rendered.document is None
+    assert_sendable(rendered.messages[0])
+
+
+def test_render_output_truncated():
+    text = TEXTS["markup"]
+    output = CommandOutput(stdout=text, stderr="", bytes_read=1024, truncated=True)
+    rendered = render_output(output, OutputPolicy(max_output_bytes=1024, inline_messages=1), LIMIT)
+
+    assert rendered.messages[-1] == "<i>Output truncated at 1024 bytes.</i>"
+    assert rendered.document_name == "output-truncated.log.gz"
+    assert "truncated at the 1024-byte limit" in rendered.document_caption
+    for message in rendered.messages:
+        assert_sendable(message)
+
+
+@pytest.mark.parametrize("name", TEXTS)
+def test_render_output_header_fits_limit(name):
+    text = TEXTS[name]
+    header = "<b>web-01 😀</b>: <code>cat /var/log/syslog &amp;&amp; uptime</code>"
+    output = CommandOutput(stdout=text, stderr="", bytes_read=len(text.encode()))
+    rendered = render_output(output, OutputPolicy(inline_messages=2), LIMIT, header)
+
+    assert rendered.messages[0].startswith(f"{header}\n")
+    for message in rendered.messages:
+        assert_sendable(message)
+
+
+def test_render_output_empty():
+    rendered = render_output(CommandOutput(stdout=" \n", stderr="", bytes_read=2), OutputPolicy(), LIMIT)
+
+    assert rendered.messages == ["Command completed with no output."]
+
+
+def test_render_output_empty_with_header():
+    output = CommandOutput(stdout="", stderr="", bytes_read=0)
+    rendered = render_output(output, OutputPolicy(), LIMIT, "<b>web-01</b>: <code>true</code>")
+
+    assert rendered.messages == ["<b>web-01</b>: <code>true</code>\nCommand completed with no output."]
+
+
+@pytest.mark.parametrize("name, kind, value, expected", [
+    ("inline_messages", int, 2, 2),
+    ("inline_messages", int, "4", 4),
+    ("max_output_bytes", int, 2048.0, 2048),
+    ("attach_full_output", bool, True, True),
+    ("attach_full_output", bool, "No", False),
+    ("attach_full_output", bool, "yes", True),
+])
+def test_convert_setting(name, kind, value, expected):
+    assert _convert_setting(name, kind, value) == expected
+
+
+@pytest.mark.parametrize("name, kind, value", [
+    ("inline_messages", int, 0),
+    ("preview_lines", int, -1),
+    ("inline_messages", int, True),
+    ("max_output_bytes", int, 1.5),
+    ("max_output_bytes", int, "lots"),
+    ("attach_full_output", bool, "maybe"),
+    ("attach_full_output", bool, 1),
+])
+def test_convert_setting_rejects_invalid(name, kind, value):
+    with pytest.raises((TypeError, ValueError)):
+        _convert_setting(name, kind, value)
@@ -1,13 +1,15 @@
 # user.py
 import json
 
+ROLES_FILE = 'roles.json'
+
 class User:
     def __init__(self, telegram_id: int, role: str):
         self.telegram_id = telegram_id
         self.role = role
 
     @staticmethod
-    def load_roles(file_path: str = 'roles.json'):
+    def load_roles(file_path: str = ROLES_FILE):
         with open(file_path, 'r') as file:
             return json.load(file)
 